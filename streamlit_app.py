@@ -1,8 +1,9 @@
+import os
 import streamlit as st
 import pandas as pd
+import numpy as np
 import folium
 from folium import plugins
-from streamlit_folium import folium_static
 import plotly.express as px
 from PIL import Image
 
@@ -17,7 +18,7 @@ st.set_page_config(
 st.markdown("""
     <style>
     .stSelectbox {margin-bottom: 1rem;}
-    .stButton>button {
+    .stButton>button, .stFormSubmitButton>button {
         background-color: #605ca8;
         color: white;
         width: 100%;
@@ -25,19 +26,61 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+DATA_FILE = "occurrence_filtered_final.parquet"
+
+# Categorical columns the sidebar can filter on
+FILTER_COLUMNS = ['phylum', 'class', 'species', 'continent', 'countryCode',
+                  'state', 'county', 'landcover', 'iucnRedListCategory']
+
+# Columns matched by the quick search
+SEARCH_COLUMNS = ['species', 'phylum', 'class', 'state', 'countryCode', 'county',
+                  'landcover', 'iucnRedListCategory']
+
+# Columns shown in the map popup, in the order MARKER_CALLBACK reads them
+POPUP_COLUMNS = ['species', 'phylum', 'class', 'county', 'state', 'countryCode',
+                 'landcover', 'iucnRedListCategory']
+
+# Columns create_map reads; frames are cut down to these before rendering
+MAP_COLUMNS = ['latitude', 'longitude'] + POPUP_COLUMNS
+
+# Above this many points the map switches from markers to a heatmap
+HEATMAP_THRESHOLD = 5000
+
+# Version of the rendered map output, part of the key of the on-disk default
+# map snapshot. Bump it whenever create_map, MARKER_CALLBACK, MAP_COLUMNS or
+# HEATMAP_THRESHOLD change, otherwise restarted apps keep serving the old
+# snapshot; any other change to the rendered HTML needs `streamlit cache clear`.
+MAP_VERSION = 1
+
+# Leaflet callback used by FastMarkerCluster; each row is
+# [lat, lon, color, *POPUP_COLUMNS]
+MARKER_CALLBACK = """
+    function (row) {
+        var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+            radius: 6, color: row[2], fill: true, fillOpacity: 0.7, weight: 2
+        });
+        var popup = "<div style='font-family: Arial; font-size: 12px;'>" +
+            "<strong style='font-size: 14px;'>🦁 " + row[3] + "</strong><br>" +
+            "🧬 " + row[4] + " - " + row[5] + "<br>" +
+            "📍 " + row[6] + ", " + row[7] + ", " + row[8] + "<br>" +
+            "🌱 Landcover: " + row[9] + "<br>" +
+            "⚠️ IUCN: " + row[10] +
+            "</div>";
+        marker.bindPopup(popup, {maxWidth: 300});
+        return marker;
+    }
+"""
+
 def get_unique_values(df, column):
-    """Get unique values from a column, properly handling mixed types and NaN values"""
-    # Get unique values and convert to list
-    unique_vals = df[column].unique()
-    # Convert all values to strings, handling NaN values
-    unique_vals = [str(x) for x in unique_vals if pd.notna(x)]
-    # Sort the list
-    return sorted(unique_vals)
+    """Get the sorted unique values of a categorical column that occur in df"""
+    return list(df[column].cat.remove_unused_categories().cat.categories)
 
-@st.cache_data
+# Cached as a shared resource: reruns get the same frame back without the
+# pickle copy (and hashing) cache_data does, so callers must not mutate it
+@st.cache_resource
 def load_data():
     """Load and preprocess the wildlife data"""
-    df = pd.read_excel("occurrence_filtered_final.xlsx")
+    df = pd.read_parquet(DATA_FILE)
     df = df.rename(columns={'lon_keep': 'longitude', 'lat_keep': 'latitude'})
     
     # Ensure coordinates are numeric
@@ -45,15 +88,26 @@ def load_data():
     df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
     
     # Convert categorical columns to string type, handling NaN values
-    string_columns = ['phylum', 'class', 'species', 'continent', 'countryCode', 
-                     'state', 'county', 'landcover', 'iucnRedListCategory']
-    
-    for col in string_columns:
+    for col in FILTER_COLUMNS:
         if col in df.columns:
             df[col] = df[col].fillna('').astype(str)
             # Replace 'nan' with empty string
             df[col] = df[col].replace('nan', '')
     
+    # Lowercased concatenation of the searchable columns, so quick search is a
+    # single substring scan instead of one per column. Built here so the
+    # cached frame carries it and reruns never rebuild it. Arrow-backed
+    # strings let str.contains run in Arrow's compute kernels.
+    df['_search_blob'] = df[SEARCH_COLUMNS[0]].str.cat(
+        df[SEARCH_COLUMNS[1:]], sep='|'
+    ).str.lower().astype('string[pyarrow]')
+    
+    # Store the filter columns as ordered categories so equality filters
+    # compare integer codes and the sorted unique values are the categories
+    for col in FILTER_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.Categorical(df[col], categories=sorted(df[col].unique()), ordered=True)
+    
     # Remove rows with invalid coordinates
     df = df.dropna(subset=['longitude', 'latitude'])
     
@@ -65,81 +119,124 @@ def load_data():
     
     return df
 
+@st.cache_data
+def load_filter_options():
+    """Compute the unique values of every filter column once for the loaded data"""
+    df = load_data()
+    return {col: get_unique_values(df, col) for col in FILTER_COLUMNS}
+
+@st.cache_resource
+def load_row_index():
+    """Map every value of each filter column to the sorted row positions holding it"""
+    df = load_data()
+    return {col: df.groupby(col, observed=True).indices for col in FILTER_COLUMNS}
+
+@st.cache_resource
+def load_global_center():
+    """Compute the center of the full dataset once, for maps showing every row"""
+    df = load_data()
+    return df['latitude'].mean(), df['longitude'].mean()
+
 # Sidebar filters
+def reset_filters():
+    """Put every sidebar filter back to its default value"""
+    st.session_state['search'] = ""
+    for col in FILTER_COLUMNS:
+        st.session_state[col] = "All"
+
+def narrow(df, column, value):
+    """Keep the rows matching a selectbox value, or every row for 'All'"""
+    return df if value == "All" else df[df[column] == value]
+
 def create_filters(df):
-    with st.sidebar:
+    options = load_filter_options()
+    
+    def choices(subset, column):
+        # Dependent dropdowns only offer values present in the rows left by the
+        # filters above them; an unnarrowed subset reuses the cached options
+        if len(subset) == len(df):
+            return ["All"] + options[column]
+        return ["All"] + get_unique_values(subset, column)
+    
+    # The filters live in a form so typing a search or picking values does not
+    # rerun the app on every change; they are applied together on submit.
+    # Dependent dropdowns therefore narrow after each Apply.
+    with st.sidebar.form("filters"):
         st.title("🔍 Filters")
         
         # Quick search
-        search = st.text_input("Quick Search", placeholder="Search any field...")
+        search = st.text_input("Quick Search", placeholder="Search any field...", key="search")
         
         # Taxonomy section
         st.header("🧬 Taxonomy")
-        phylum = st.selectbox("Phylum", ["All"] + get_unique_values(df, 'phylum'))
-        class_ = st.selectbox("Class", ["All"] + get_unique_values(df, 'class'))
-        species = st.selectbox("Species", ["All"] + get_unique_values(df, 'species'))
+        taxa = df[['phylum', 'class', 'species']]
+        phylum = st.selectbox("Phylum", choices(taxa, 'phylum'), key='phylum')
+        taxa = narrow(taxa, 'phylum', phylum)
+        class_ = st.selectbox("Class", choices(taxa, 'class'), key='class')
+        taxa = narrow(taxa, 'class', class_)
+        species = st.selectbox("Species", choices(taxa, 'species'), key='species')
         
         # Location section
         st.header("🌍 Location")
-        continent = st.selectbox("Continent", ["All"] + get_unique_values(df, 'continent'))
-        country = st.selectbox("Country", ["All"] + get_unique_values(df, 'countryCode'))
-        state = st.selectbox("State", ["All"] + get_unique_values(df, 'state'))
-        county = st.selectbox("County", ["All"] + get_unique_values(df, 'county'))
-        landcover = st.selectbox("Landcover", ["All"] + get_unique_values(df, 'landcover'))
+        places = df[['continent', 'countryCode', 'state', 'county']]
+        continent = st.selectbox("Continent", choices(places, 'continent'), key='continent')
+        places = narrow(places, 'continent', continent)
+        country = st.selectbox("Country", choices(places, 'countryCode'), key='countryCode')
+        places = narrow(places, 'countryCode', country)
+        state = st.selectbox("State", choices(places, 'state'), key='state')
+        places = narrow(places, 'state', state)
+        county = st.selectbox("County", choices(places, 'county'), key='county')
+        landcover = st.selectbox("Landcover", choices(df, 'landcover'), key='landcover')
         
         # Status section
         st.header("🏷️ Status")
-        iucn = st.selectbox("IUCN Status", ["All"] + get_unique_values(df, 'iucnRedListCategory'))
+        iucn = st.selectbox("IUCN Status", choices(df, 'iucnRedListCategory'), key='iucnRedListCategory')
         
-        # Reset button
-        if st.button("🔄 Reset All"):
-            st.experimental_rerun()
+        # Apply and reset buttons
+        st.form_submit_button("✅ Apply")
+        st.form_submit_button("🔄 Reset All", on_click=reset_filters)
             
     return search, phylum, class_, species, continent, country, state, county, landcover, iucn
 
-def filter_data(df, search, phylum, class_, species, continent, country, state, county, landcover, iucn):
+# Filters as returned by create_filters when nothing has been changed
+DEFAULT_FILTERS = ("",) + ("All",) * len(FILTER_COLUMNS)
+
+def filter_data(df, row_index, search, phylum, class_, species, continent, country, state, county, landcover, iucn):
     """Apply filters to the dataframe"""
+    # Intersect the row positions matching each active filter and take the
+    # surviving rows once at the end
+    idx = None
+    
     if search:
-        search = search.lower()
-        df = df[
-            df['species'].str.lower().str.contains(search, na=False) |
-            df['phylum'].str.lower().str.contains(search, na=False) |
-            df['class'].str.lower().str.contains(search, na=False) |
-            df['state'].str.lower().str.contains(search, na=False) |
-            df['countryCode'].str.lower().str.contains(search, na=False) |
-            df['county'].str.lower().str.contains(search, na=False) |
-            df['landcover'].str.lower().str.contains(search, na=False) |
-            df['iucnRedListCategory'].str.lower().str.contains(search, na=False)
-        ]
+        matches = df['_search_blob'].str.contains(search.lower(), regex=False, na=False)
+        idx = np.flatnonzero(matches.to_numpy(dtype=bool))
     
-    if phylum != "All": df = df[df['phylum'] == phylum]
-    if class_ != "All": df = df[df['class'] == class_]
-    if species != "All": df = df[df['species'] == species]
-    if continent != "All": df = df[df['continent'] == continent]
-    if country != "All": df = df[df['countryCode'] == country]
-    if state != "All": df = df[df['state'] == state]
-    if county != "All": df = df[df['county'] == county]
-    if landcover != "All": df = df[df['landcover'] == landcover]
-    if iucn != "All": df = df[df['iucnRedListCategory'] == iucn]
+    selections = (phylum, class_, species, continent, country, state, county, landcover, iucn)
+    for col, value in zip(FILTER_COLUMNS, selections):
+        if value != "All":
+            rows = row_index[col].get(value, np.array([], dtype=np.intp))
+            idx = rows if idx is None else np.intersect1d(idx, rows, assume_unique=True)
     
-    return df
+    return df if idx is None else df.take(idx)
 
-def create_map(df):
+def create_map(df, center=None):
     """Create a folium map with the filtered data"""
-    # If dataset is too large, sample it
-    MAX_POINTS = 1000
-    if len(df) > MAX_POINTS:
-        st.warning(f"Showing a sample of {MAX_POINTS} points out of {len(df)} total points for better performance.")
-        df = df.sample(n=MAX_POINTS, random_state=42)
-    
-    # Calculate center of the map based on data points
-    center_lat = df['latitude'].mean()
-    center_lon = df['longitude'].mean()
+    # Calculate center of the map based on data points unless one is given
+    if center is None:
+        center = (df['latitude'].mean(), df['longitude'].mean())
+    center_lat, center_lon = center
     
     # Create the base map
     m = folium.Map(location=[center_lat, center_lon], zoom_start=4,
                   tiles='CartoDB positron', control_scale=True)
     
+    # Large selections are drawn as a density layer from a single array of
+    # points instead of a marker and popup per observation
+    if len(df) > HEATMAP_THRESHOLD:
+        points = list(zip(df['latitude'].tolist(), df['longitude'].tolist()))
+        plugins.HeatMap(points, radius=10).add_to(m)
+        return m
+    
     # Create color dictionary for IUCN categories
     colors = {
         'LC': '#2ecc71',     # Safe green
@@ -149,35 +246,19 @@ def create_map(df):
         'CR': '#9b59b6'      # Critical purple
     }
     
-    # Create marker cluster for better performance with many points
-    marker_cluster = folium.plugins.MarkerCluster().add_to(m)
+    # Build one [lat, lon, color, popup fields...] row per point; the markers
+    # themselves are created in the browser by MARKER_CALLBACK. Zipping the
+    # per-column lists avoids upcasting the mixed columns into one object array.
+    marker_colors = df['iucnRedListCategory'].str.strip().map(colors).fillna('#95a5a6')
+    marker_data = list(zip(
+        df['latitude'].tolist(),
+        df['longitude'].tolist(),
+        marker_colors.tolist(),
+        *(df[col].tolist() for col in POPUP_COLUMNS)
+    ))
     
-    # Add markers for each point
-    for idx, row in df.iterrows():
-        try:
-            # Create popup content
-            popup_text = f"""
-                <div style='font-family: Arial; font-size: 12px;'>
-                    <strong style='font-size: 14px;'>🦁 {row['species']}</strong><br>
-                    🧬 {row['phylum']} - {row['class']}<br>
-                    📍 {row['county']}, {row['state']}, {row['countryCode']}<br>
-                    🌱 Landcover: {row['landcover']}<br>
-                    ⚠️ IUCN: {row['iucnRedListCategory']}
-                </div>
-            """
-            
-            # Create the circle marker
-            folium.CircleMarker(
-                location=[float(row['latitude']), float(row['longitude'])],
-                radius=6,
-                popup=folium.Popup(popup_text, max_width=300),
-                color=colors.get(row['iucnRedListCategory'].strip(), '#95a5a6'),
-                fill=True,
-                fillOpacity=0.7,
-                weight=2
-            ).add_to(marker_cluster)
-        except Exception as e:
-            continue
+    # Client-side clustering keeps every point of the smaller selections
+    plugins.FastMarkerCluster(data=marker_data, callback=MARKER_CALLBACK).add_to(m)
     
     # Add a legend
     legend_html = """
@@ -195,6 +276,24 @@ def create_map(df):
     
     return m
 
+@st.cache_data(max_entries=20)
+def render_map_html(filters, _df):
+    """Render the map for a set of filters to HTML, reused until the filters change"""
+    # The filtered frame is fully determined by the filters, so it is left
+    # out of the cache key instead of being hashed on every rerun.
+    # A filter set that keeps every row (or none, leaving nothing to average)
+    # reuses the precomputed global center
+    center = load_global_center() if len(_df) in (0, len(load_data())) else None
+    return create_map(_df[MAP_COLUMNS], center).get_root().render()
+
+@st.cache_data(persist="disk")
+def render_default_map_html(data_version, map_version, folium_version):
+    """Render the unfiltered map once and keep the HTML on disk across restarts"""
+    # The arguments only key the snapshot: it is rebuilt when the data file's
+    # mtime, MAP_VERSION or the installed folium version changes. Streamlit
+    # hashes just this function's source, not the map code it calls.
+    return create_map(load_data()[MAP_COLUMNS], load_global_center()).get_root().render()
+
 def main():
     try:
         # Load data
@@ -203,44 +302,62 @@ def main():
         # Create filters
         filters = create_filters(df)
         
-        # Apply filters
-        filtered_df = filter_data(df, *filters)
+        # Apply filters, reusing the last result while the submitted filters
+        # are unchanged (e.g. when only the selected tab changes)
+        if st.session_state.get('applied_filters') != filters:
+            st.session_state['applied_filters'] = filters
+            st.session_state['filtered_df'] = filter_data(df, load_row_index(), *filters)
+        filtered_df = st.session_state['filtered_df']
         
-        # Create tabs
-        tab1, tab2, tab3 = st.tabs(["🗺️ Map", "📊 Data", "ℹ️ Info"])
+        # Create tabs; tracking the selected tab lets the others skip their work
+        tab1, tab2, tab3 = st.tabs(["🗺️ Map", "📊 Data", "ℹ️ Info"],
+                                   key="active_tab", on_change="rerun")
         
         with tab1:
-            # Metrics
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("Species 🦁", len(filtered_df['species'].unique()))
-            with col2:
-                st.metric("Observations 📍", len(filtered_df))
-            with col3:
-                st.metric("Countries 🌍", len(filtered_df['countryCode'].unique()))
-            with col4:
-                most_common_status = filtered_df['iucnRedListCategory'].mode()[0]
-                st.metric("Most Common Status ⚠️", most_common_status)
-            
-            # Map
-            st.write("### Interactive Map")
-            m = create_map(filtered_df)
-            folium_static(m, width=1200, height=600)
+            if tab1.open:
+                # Metrics
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Species 🦁", len(filtered_df['species'].unique()))
+                with col2:
+                    st.metric("Observations 📍", len(filtered_df))
+                with col3:
+                    st.metric("Countries 🌍", len(filtered_df['countryCode'].unique()))
+                with col4:
+                    if filtered_df.empty:
+                        most_common_status = "N/A"
+                    else:
+                        most_common_status = filtered_df['iucnRedListCategory'].value_counts().idxmax()
+                    st.metric("Most Common Status ⚠️", most_common_status)
+                
+                # Map
+                st.write("### Interactive Map")
+                if len(filtered_df) > HEATMAP_THRESHOLD:
+                    st.info(f"Showing observation density for {len(filtered_df)} points. "
+                            f"Narrow the filters to {HEATMAP_THRESHOLD} or fewer to see individual records.")
+                if filters == DEFAULT_FILTERS:
+                    map_html = render_default_map_html(os.path.getmtime(DATA_FILE), MAP_VERSION,
+                                                       folium.__version__)
+                else:
+                    map_html = render_map_html(filters, filtered_df)
+                st.iframe(map_html, height=600)
         
         with tab2:
-            st.write("### Filtered Data")
-            
-            # Download button
-            csv = filtered_df.to_csv(index=False)
-            st.download_button(
-                label="📥 Download Data",
-                data=csv,
-                file_name="wildlife-data.csv",
-                mime="text/csv"
-            )
-            
-            # Display dataframe
-            st.dataframe(filtered_df, use_container_width=True)
+            if tab2.open:
+                st.write("### Filtered Data")
+                display_df = filtered_df.drop(columns=['_search_blob'])
+                
+                # Download button
+                csv = display_df.to_csv(index=False)
+                st.download_button(
+                    label="📥 Download Data",
+                    data=csv,
+                    file_name="wildlife-data.csv",
+                    mime="text/csv"
+                )
+                
+                # Display dataframe
+                st.dataframe(display_df, use_container_width=True)
         
         with tab3:
             st.write("### About This Dataset")